@@ -61,12 +61,34 @@ Approach:
     not thread safe.
 """
 
+import bisect
+import multiprocessing
 import re
+import sys
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+from itertools import accumulate, compress, count, islice
 
 _TOKENIZE_DOC_RE = re.compile(r'(\W)', flags=re.UNICODE)
+# same tokens as _TOKENIZE_DOC_RE for ASCII-only text, without the unicode
+# character class lookups
+_TOKENIZE_DOC_ASCII_RE = re.compile(r'(\W)', flags=re.ASCII)
 _TOKENIZE_QUERY_RE = re.compile(r'\W', flags=re.UNICODE)
-_STOP_WORDS = set('i/to/it/he/she/they/me/am/is/are/be/being/been/have/has/having/had/do/does/doing/did'.split('/'))
+_STOP_WORDS = frozenset('i/to/it/he/she/they/me/am/is/are/be/being/been/have/has/having/had/do/does/doing/did'.split('/'))
 _SUFFIXES = ('s', 'ed', 'ing', 'ly')
+_SUFFIX_RE = re.compile(r'(?:%s)\Z' % '|'.join(sorted(_SUFFIXES, key=len, reverse=True)), flags=re.UNICODE)
+_POSITIVE_WORDS = ('love', 'awesome', 'great', 'super', 'delicious', 'best')
+_SENTENCE_TERMINALS = frozenset('.;!?')
+_WINDOW_SIZE = 20
+# scores are ints, (a query match is worth 10x a positive word) so the window
+# sums are exact and stay small, cached int objects
+_QUERY_MATCH_SCORE = 10
+_SENTIMENT_SCORE = 1
+_WINDOW_SUM_PRECISION = 9
+_STEM_CACHE = {}
+_STEM_CACHE_SIZE = 50000
+_HIGHLIGHT_CACHE_SIZE = 10000
+_WORKER_QUERY = None
 
 def build_scorecard(data, starting_score):
     """
@@ -74,7 +96,7 @@ def build_scorecard(data, starting_score):
     to each index of the data string.
 
     Args:
-        data - A (unicode) string representing the text to score.
+        data - A string representing the text to score.
         starting_score - A float which is used as the default score for each index.
 
     Returns: A list containing len(data) elements, all set to starting_score
@@ -84,7 +106,7 @@ def build_scorecard(data, starting_score):
     return [starting_score] * len(data)
 
 
-def build_stem_index(tokens, stem_lookup):
+def build_stem_index(tokens, stem_lookup, offsets=None):
     """
     Creates a mapping from token to (start/end) position of the token's stem
     in the list of tokens.
@@ -92,6 +114,8 @@ def build_stem_index(tokens, stem_lookup):
     Args:
         tokens - A list of strings representing the document to index
         stem_lookup - A dictionary mapping a token to its stem
+        offsets - (optional) A list built using the build_token_offsets()
+            function. It is built from tokens if not given.
 
     Returns: A dictionary mapping each token to the position of its stem
     in the flattened string.
@@ -108,19 +132,17 @@ def build_stem_index(tokens, stem_lookup):
     """
     tokens = tokens or []
     stem_lookup = stem_lookup or {}
+    if offsets is None:
+        offsets = build_token_offsets(tokens)
 
-    index = {}
-    cur_pos = 0
-    for token in tokens:
-        token_len = len(token)
+    index = defaultdict(list)
+    for token_index, token in enumerate(tokens):
         if token:
             stem = stem_lookup.get(token)
             if stem:
-                index.setdefault(stem, []).append((cur_pos, cur_pos + token_len))
-
-        cur_pos += token_len
+                index[stem].append((offsets[token_index], offsets[token_index + 1]))
 
-    return index
+    return dict(index)
 
 
 def score_index(stem_index, scorecard, score_fn):
@@ -137,16 +159,22 @@ def score_index(stem_index, scorecard, score_fn):
     Returns: None
 
     NOTE: This function modifies scorecard
+    NOTE: score_fn is called once per stem, not once per location, and
+        stems that score 0 are skipped
     """
 
     if None in (stem_index, scorecard, score_fn):
         raise ValueError('one or more parameters are invalid')
 
-    for stem, locations in stem_index.iteritems():
-        for start, end in locations:
-            score = score_fn(stem)
-            for i in xrange(start, start + len(stem)):
-                scorecard[i] += score
+    for stem, locations in stem_index.items():
+        score = score_fn(stem)
+        if not score:
+            continue
+
+        stem_len = len(stem)
+        for start, _ in locations:
+            end = start + stem_len
+            scorecard[start:end] = [cur_score + score for cur_score in scorecard[start:end]]
 
 
 def get_window_scores(scorecard, window_size):
@@ -163,18 +191,206 @@ def get_window_scores(scorecard, window_size):
 
     Returns: A list of tuples containing the score, start and end index of the window.
         e.g. [(score, start_index_of_window, end_index_of_window), (...), ...]
+
+    NOTE: Window sums are taken from a running (prefix) sum of the scorecard
+        so each window costs O(1) instead of O(window_size).
+    """
+    prefix_sums = build_prefix_sums(scorecard)
+    return [(window_sum(prefix_sums, start, start + window_size), start, start + window_size)
+            for start in range(len(scorecard) - window_size)]
+
+
+def best_window(scorecard, window_size):
+    """
+    Finds the highest scoring window in the scorecard. This is the same as
+    sorting the results of get_window_scores() and picking the first one,
+    (ties go to the earliest window) in a single pass that doesn't build,
+    or sort, a list of windows.
+
+    Args:
+        scorecard - A scorecard built using the build_scorecard() function and
+            scored using score_index().
+        window_size - An int defining how large of a sliding window to use
+            while calculating the score.
+
+    Returns: A tuple containing the score, start and end index of the best window.
+        e.g. (score, start_index_of_window, end_index_of_window)
+        If the scorecard is not longer than window_size, the whole scorecard
+        is used as the window.
     """
-    ret = []
     scorecard_len = len(scorecard)
-    cur_index = 0
-    end_index = cur_index + window_size
+    if scorecard_len <= window_size:
+        return (round(sum(scorecard, 0.0), _WINDOW_SUM_PRECISION), 0, scorecard_len)
+
+    # slide a running sum along the scorecard, only remembering the best window
+    epsilon = 10 ** -_WINDOW_SUM_PRECISION
+    window_score = sum(scorecard[:window_size], 0.0)
+    best_score = window_score
+    best_start = 0
+    for start in range(1, scorecard_len - window_size):
+        window_score += scorecard[start + window_size - 1]
+        window_score -= scorecard[start - 1]
+        if window_score > best_score + epsilon:
+            best_score = window_score
+            best_start = start
+
+    return (round(best_score, _WINDOW_SUM_PRECISION), best_start, best_start + window_size)
+
+
+def best_window_for_index(stem_index, data_len, score_fn, window_size):
+    """
+    Scores the data and finds the highest scoring window in one pass. This
+    gives the same window as building a scorecard, scoring it with
+    score_index() and calling best_window(), but never builds the
+    scorecard or the prefix sums.
+
+    Args:
+        stem_index - An index built using the build_stem_index() function
+        data_len - An int, the length of the data string that was indexed
+        score_fn - A function that takes in a stemmed word and returns a float
+        window_size - An int defining how large of a sliding window to use
+            while calculating the score.
+
+    Returns: A tuple containing the score, start and end index of the best window.
+        e.g. (score, start_index_of_window, end_index_of_window)
+        @see best_window()
+    """
+    if not data_len:
+        return (0.0, 0, 0)
+
+    # deltas[i] is the change in score from index i - 1 to index i. Only the
+    # stem boundaries are set, every other entry is the same 0.0 object.
+    deltas = [0.0] * (data_len + 1)
+    for stem, locations in stem_index.items():
+        score = score_fn(stem)
+        if not score:
+            continue
+        stem_len = len(stem)
+        for start, _ in locations:
+            deltas[start] += score
+            deltas[start + stem_len] -= score
 
-    while end_index < scorecard_len:
-        ret.append((sum(scorecard[cur_index:end_index]), cur_index, end_index))
-        cur_index += 1
-        end_index += 1
+    return _best_window_for_deltas(deltas, data_len, window_size, 10 ** -_WINDOW_SUM_PRECISION)
 
-    return ret
+
+def best_window_for_tokens(token_offsets, token_stem_ids, stem_scores, stem_lens, window_size):
+    """
+    Same as best_window_for_index(), but the stems of the data are numbered
+    and given as flat lists instead of a stem index, so scoring the data is
+    just list indexing.
+
+    Args:
+        token_offsets - A list built using the build_token_offsets() function
+        token_stem_ids - A list of ints, the stem id of each token
+        stem_scores - A list of numbers, the score of each stem id. If they
+            are all ints the window sums are exact.
+        stem_lens - A list of ints, the length of each stem id
+        window_size - An int defining how large of a sliding window to use
+            while calculating the score.
+
+    Returns: A tuple containing the score, start and end index of the best window.
+        e.g. (score, start_index_of_window, end_index_of_window)
+        @see best_window()
+    """
+    data_len = token_offsets[-1]
+    if not data_len:
+        return (0, 0, 0)
+
+    deltas = [0] * (data_len + 1)
+    is_scored = [bool(score) for score in stem_scores]
+    # only visit the tokens that score, the rest are filtered out without
+    # running any python code per token
+    for token_index in compress(count(), map(is_scored.__getitem__, token_stem_ids)):
+        stem_id = token_stem_ids[token_index]
+        score = stem_scores[stem_id]
+        start = token_offsets[token_index]
+        deltas[start] += score
+        deltas[start + stem_lens[stem_id]] -= score
+
+    # int scores add up exactly so ties don't need any slack
+    exact = all(isinstance(score, int) for score in stem_scores)
+    return _best_window_for_deltas(deltas, data_len, window_size, 0 if exact else 10 ** -_WINDOW_SUM_PRECISION)
+
+
+def _best_window_for_deltas(deltas, data_len, window_size, epsilon):
+    """
+    Slides the window along the data for best_window_for_index() and
+    best_window_for_tokens().
+
+    Args:
+        deltas - A list of data_len + 1 numbers where element i is the change
+            in score from index i - 1 to index i
+        data_len - An int, the length of the data string
+        window_size - An int defining how large of a sliding window to use
+        epsilon - A number, how much higher a window has to score to beat an
+            earlier one. Use 0 for int scores, which add up exactly.
+
+    Returns: A tuple containing the score, start and end index of the best window.
+    """
+    if data_len <= window_size:
+        window_size = data_len
+        num_windows = 1
+    else:
+        num_windows = data_len - window_size
+
+    # the scores of the indices entering and leaving the window are both
+    # running totals of deltas, so no per-index scores are ever stored
+    entering_score = 0
+    window_score = 0
+    for index in range(window_size):
+        entering_score += deltas[index]
+        window_score += entering_score
+
+    best_score = window_score
+    best_start = 0
+    threshold = best_score + epsilon
+    leaving_score = 0
+    for start in range(1, num_windows):
+        entering_score += deltas[start + window_size - 1]
+        window_score += entering_score
+        leaving_score += deltas[start - 1]
+        window_score -= leaving_score
+
+        if window_score > threshold:
+            best_score = window_score
+            best_start = start
+            threshold = best_score + epsilon
+
+    return (round(best_score, _WINDOW_SUM_PRECISION), best_start, best_start + window_size)
+
+
+def build_prefix_sums(scorecard):
+    """
+    Args:
+        scorecard - A scorecard built using the build_scorecard() function
+
+    Returns: A list of len(scorecard) + 1 running totals where element i is
+        the sum of scorecard[:i]. The sum of scorecard[start:end] is then just
+        prefix_sums[end] - prefix_sums[start].
+    """
+    prefix_sums = [0.0]
+    total = 0.0
+    for score in scorecard:
+        total += score
+        prefix_sums.append(total)
+
+    return prefix_sums
+
+
+def window_sum(prefix_sums, start, end):
+    """
+    Args:
+        prefix_sums - A list built using the build_prefix_sums() function
+        start - An int defining the start index of the window
+        end - An int defining the end index of the window, (exclusive)
+
+    Returns: A float, the sum of the scores in the window.
+
+    NOTE: The difference of two running totals picks up floating point noise
+        so the result is rounded, otherwise windows with the same scores
+        would not compare as equal.
+    """
+    return round(prefix_sums[end] - prefix_sums[start], _WINDOW_SUM_PRECISION)
 
 
 def tokenize(term, regex):
@@ -202,23 +418,44 @@ def english_suffix_stemmer(val):
 
     NOTE: python has a sweet implementation of Porter stemmer, below
         is a super simplified version
+    NOTE: Stems are memoized since the same tokens show up over and over
+        again. The cache is emptied once it holds _STEM_CACHE_SIZE stems.
     """
-    ret = ''
+    try:
+        return _STEM_CACHE[val]
+    except KeyError:
+        cacheable = True
+    except TypeError:
+        # unhashable, e.g. a list
+        cacheable = False
+
+    key = val
     val = val or ''
     val = val.lower().strip()
 
-    for suffix in _SUFFIXES:
-        if val.endswith(suffix):
-            val = val[:-len(suffix)]
-            break
+    if val.endswith(_SUFFIXES):
+        val = val[:_SUFFIX_RE.search(val).start()]
 
     if val in _STOP_WORDS:
         val = ''
 
+    if cacheable:
+        if isinstance(val, str):
+            # the same stems are used as keys over and over again, interning
+            # them lets dict and set lookups short circuit on identity
+            val = sys.intern(val)
+        if len(_STEM_CACHE) >= _STEM_CACHE_SIZE:
+            _STEM_CACHE.clear()
+        _STEM_CACHE[key] = val
+
     return val
 
 
-def find_best_terminal_token(start_index, tokens, sentence_terminals, direction=1):
+_POSITIVE_STEMS = frozenset(english_suffix_stemmer(word) for word in _POSITIVE_WORDS)
+
+
+def find_best_terminal_token(start_index, tokens, sentence_terminals, direction=1, offsets=None,
+                             terminal_indices=None):
     """
     Given an index into the data string, this function will return the
     index into the token list which corresponds to a "natural" boundary
@@ -234,6 +471,12 @@ def find_best_terminal_token(start_index, tokens, sentence_terminals, direction=
         direction - An in defining which direction to look for the terminal
             in. This value should only be either -1 for reverse order or
             1 for forward.
+        offsets - (optional) A list built using the build_token_offsets()
+            function. Pass this in when making several calls with the same
+            tokens so the offsets are only computed once.
+        terminal_indices - (optional) A list built using the
+            build_terminal_indices() function. Like offsets, pass this in
+            to avoid rebuilding it on every call.
 
     Returns: An int corresponding to the index in the tokens list for the
         most natural boundary.
@@ -241,23 +484,60 @@ def find_best_terminal_token(start_index, tokens, sentence_terminals, direction=
     if direction not in (-1, 1):
         raise Exception('Invalid direction, must be either -1 or 1')
 
-    token_index = data_index_to_token_index(start_index, tokens)
+    token_index = data_index_to_token_index(start_index, tokens, offsets)
 
     min_token_index = 0
     max_token_index = len(tokens) - 1
 
-    while token_index > min_token_index and token_index < max_token_index:
-        token_index += direction
-        if tokens[token_index] in sentence_terminals:
-            if direction == -1:
-                return token_index + 1
-            else:
-                break
+    if token_index is None or token_index <= min_token_index or token_index >= max_token_index:
+        return token_index
 
-    return token_index
+    if terminal_indices is None:
+        terminal_indices = build_terminal_indices(tokens, sentence_terminals)
+
+    if direction == -1:
+        # the token right after the closest terminal before token_index
+        i = bisect.bisect_left(terminal_indices, token_index)
+        return terminal_indices[i - 1] + 1 if i else min_token_index
+
+    # the closest terminal after token_index
+    i = bisect.bisect_right(terminal_indices, token_index)
+    return terminal_indices[i] if i < len(terminal_indices) else max_token_index
 
 
-def data_index_to_token_index(data_index, tokens):
+def build_terminal_indices(tokens, sentence_terminals):
+    """
+    Args:
+        tokens - A list of strings generated using the tokenize() function
+        sentence_terminals - A set or dict or list containing the terminal
+            characters, @see find_best_terminal_token()
+
+    Returns: A sorted list of the indices into tokens of every sentence terminal.
+        e.g. tokens = ['Yum', '!', '', ' ', 'Go', '.']
+             returns [1, 5]
+    """
+    if not isinstance(sentence_terminals, (set, frozenset, dict)):
+        # one hash lookup per token instead of a scan of the terminals
+        sentence_terminals = frozenset(sentence_terminals or ())
+
+    return [token_index for token_index, token in enumerate(tokens or []) if token in sentence_terminals]
+
+
+def build_token_offsets(tokens):
+    """
+    Args:
+        tokens - A list of strings generated using the tokenize() function
+
+    Returns: A list of len(tokens) + 1 ints where element i is the index into
+        the data string at which tokens[i] starts, (the last element is the
+        length of the data string.)
+        e.g. tokens = ['She', ' ', 'loves']
+             returns [0, 3, 4, 9]
+    """
+    return list(accumulate(map(len, tokens or []), initial=0))
+
+
+def data_index_to_token_index(data_index, tokens, offsets=None):
     """
     Maps a data index to a token index. Data indices correspond to
     an index in the raw data used to generate the tokens.
@@ -265,17 +545,22 @@ def data_index_to_token_index(data_index, tokens):
     Args:
         data_index - An int index into the data. (data is just ''.join(tokens))
         tokens - A list containing a string, generated from the tokenize() function
+        offsets - (optional) A list built using the build_token_offsets()
+            function. It is built from tokens if not given.
 
-    Returns: An int index into the tokens list
+    Returns: An int index into the tokens list, or None if data_index is
+        outside of the data. An index that falls on the boundary between
+        two tokens maps to the first of them.
     """
-    index = 0
-    for token_index, token in enumerate(tokens):
-        token_len = len(token)
-        if data_index >= index and data_index <= index + token_len:
-            return token_index
-        index += token_len
+    if offsets is None:
+        offsets = build_token_offsets(tokens)
+
+    # the first token whose end offset is at or past data_index
+    token_index = bisect.bisect_left(offsets, data_index, 1) - 1
+    if token_index >= len(tokens) or data_index < offsets[token_index]:
+        return None
 
-    return None
+    return token_index
 
 
 def print_scorecard(scorecard, data):
@@ -289,11 +574,30 @@ def print_scorecard(scorecard, data):
 
     Returns: None
     """
-    print 'score: %.2f' % sum(scorecard)
-    print ' '.join(map(lambda x: '%4s' % x, list(data)))
-    print ' '.join(map(lambda x: '%.2f' % x, scorecard))
+    print('score: %.2f' % sum(scorecard))
+    print(' '.join(['%4s' % x for x in data]))
+    print(' '.join(['%.2f' % x for x in scorecard]))
+
+
+PreparedQuery = namedtuple('PreparedQuery', ('tokens', 'stems'))
+
+
+def prepare_query(query):
+    """
+    Tokenizes and stems a query so that it can be reused across many calls
+    to highlight_doc(), (e.g. for every result on a search page.)
+
+    Args:
+        query - A string containing the raw query
+
+    Returns: A PreparedQuery containing a tuple of the query's tokens and
+        a frozenset of their stems.
+    """
+    query_tokens = tuple(token for token in tokenize(query, _TOKENIZE_QUERY_RE) if token)
+    return PreparedQuery(query_tokens, frozenset(english_suffix_stemmer(token) for token in query_tokens))
 
 
+@lru_cache(maxsize=_HIGHLIGHT_CACHE_SIZE)
 def highlight_doc(doc, query):
     """
     Given a document and a query string, return a highlighted snippet
@@ -302,61 +606,89 @@ def highlight_doc(doc, query):
     Args:
         doc - A string containing the data in which to search for
             query terms.
-        query - A string containing the raw query
+        query - A string containing the raw query, or a PreparedQuery built
+            using the prepare_query() function
 
     Returns: A string containing all or part of the original doc
         string with markup potentially added to highlight query terms.
 
     Approach:
     1. Tokenize the doc, (all characters in the doc must be a part of a token)
-    2. Build a stem index based on the tokens
-    3. Tokenize the query and build a simple scoring function to match query words
-    4. Build a scorecard
-    5. Score every index with the query match scorer
-    6. Score every index with the sentiment scorer
-    7. Build the window score list and pick highest window score
+    2. Stem the tokens and number the stems
+    3. Tokenize the query and stem the query words, (unless already prepared)
+    4. Score each stem, (query match score + sentiment score)
+    5. Score every index with its stem's score
+    6. Slide the window along the scored indices
+    7. Pick the highest scoring window
     8. Find the best starting index for the window
     9. Find the best ending index for the window
     10. Add in ellipses to start if starting token does not come after a sentence boundary
     11. Add in ellipses to end if the ending token is not the end of a sentence
     10. Return the highlighted buffer from best start and end points and add in HIGHLIGHT markup
+
+    NOTE: Snippets are cached by (doc, query) so highlighting the same doc
+        again, (e.g. when a results page is refreshed) is just a lookup.
+        Use highlight_doc.cache_clear() to empty the cache.
     """
     stemmer = english_suffix_stemmer
-    positive_stems = map(stemmer, ('love', 'awesome', 'great', 'super', 'delicious', 'best'))
-    sentence_terminals = set(('.', ';', '!', '?'))
-
-    doc_tokens = tokenize(doc, _TOKENIZE_DOC_RE)
-    query_tokens = [token for token in tokenize(query, _TOKENIZE_QUERY_RE) if token]
-
-    stem_lookup = dict((token, stemmer(token)) for token in doc_tokens + query_tokens)
-    stem_index = build_stem_index(doc_tokens, stem_lookup)
-
-    query_stems = set(stem_lookup[token] for token in query_tokens)
-
-    query_match_score_fn = lambda stem: 1.0 if stem in query_stems else 0.0
-    sentiment_score_fn = lambda stem: 0.1 if stem in positive_stems else 0.0
-
-    scorecard = build_scorecard(doc, 0.0)
-
-    score_index(stem_index, scorecard, query_match_score_fn)
-    score_index(stem_index, scorecard, sentiment_score_fn)
+    positive_stems = _POSITIVE_STEMS
+    sentence_terminals = _SENTENCE_TERMINALS
+
+    if not isinstance(query, PreparedQuery):
+        query = prepare_query(query)
+    query_stems = query.stems
+
+    doc_tokens = tokenize(doc, _TOKENIZE_DOC_ASCII_RE if doc and doc.isascii() else _TOKENIZE_DOC_RE)
+
+    stem_lookup = dict((token, stemmer(token)) for token in set(doc_tokens))
+    token_offsets = build_token_offsets(doc_tokens)
+
+    # the doc regex has a single one character capture group, so the tokens
+    # alternate between words, (possibly empty) and separators. Sentence
+    # terminals can only be separators, i.e. at the odd indices.
+    terminal_indices = list(compress(range(1, len(doc_tokens), 2),
+                                     map(sentence_terminals.__contains__, islice(doc_tokens, 1, None, 2))))
+
+    # number the stems so that scoring the doc only deals with lists of ints.
+    # Each unique token is mapped straight to its stem's id so the tokens only
+    # need a single pass.
+    stems = list(set(stem_lookup.values()))
+    stem_ids = dict((stem, stem_id) for stem_id, stem in enumerate(stems))
+    token_stem_id_lookup = dict((token, stem_ids[stem]) for token, stem in stem_lookup.items())
+    token_stem_ids = list(map(token_stem_id_lookup.__getitem__, doc_tokens))
+    stem_lens = [len(stem) for stem in stems]
+
+    # query match score + sentiment score, (empty stems never score)
+    stem_scores = [(_QUERY_MATCH_SCORE if stem in query_stems else 0) + (_SENTIMENT_SCORE if stem in positive_stems else 0)
+                   if stem else 0
+                   for stem in stems]
 
     # For debugging, uncomment if you want to see how the document is scored
+    #scorecard = build_scorecard(doc, 0.0)
+    #score_index(build_stem_index(doc_tokens, stem_lookup), scorecard, dict(zip(stems, stem_scores)).get)
     #print_scorecard(scorecard, doc)
 
-    scored_windows = get_window_scores(scorecard, 20)
-    scored_windows.sort(key=lambda item: -item[0])
-    top_scored_window = scored_windows[0]
+    doc_len = len(doc or '')
+    if any(stem_scores):
+        top_scored_window = best_window_for_tokens(token_offsets, token_stem_ids, stem_scores, stem_lens,
+                                                   _WINDOW_SIZE)
+    else:
+        # nothing in the doc scores so every window ties and the first one wins
+        top_scored_window = (0, 0, min(_WINDOW_SIZE, doc_len))
 
     starting_token_index = find_best_terminal_token(top_scored_window[1],
                                                     doc_tokens,
                                                     sentence_terminals,
-                                                    direction=-1)
+                                                    direction=-1,
+                                                    offsets=token_offsets,
+                                                    terminal_indices=terminal_indices)
 
     ending_token_index = find_best_terminal_token(top_scored_window[2],
                                                   doc_tokens,
                                                   sentence_terminals,
-                                                  direction=1)
+                                                  direction=1,
+                                                  offsets=token_offsets,
+                                                  terminal_indices=terminal_indices)
 
     optimal_token_range = doc_tokens[starting_token_index:ending_token_index + 1]
     pre_start_token = doc_tokens[starting_token_index - 1] if starting_token_index > 1 else None
@@ -380,11 +712,64 @@ def highlight_doc(doc, query):
     return ''.join(markup_buffer)
 
 
+
+def highlight_docs(docs, query, workers=None):
+    """
+    Highlights several documents for the same query, (e.g. all of the
+    results on a search page) using a pool of worker processes.
+
+    Args:
+        docs - A list of strings, each one a document to pass to highlight_doc()
+        query - A string containing the raw query, or a PreparedQuery built
+            using the prepare_query() function
+        workers - (optional) An int defining how many worker processes to use.
+            Defaults to the number of CPUs. If this is 1, (or there is only
+            one doc) the docs are highlighted in the current process.
+
+    Returns: A list of highlighted snippets, in the same order as docs.
+        @see highlight_doc()
+    """
+    docs = list(docs or [])
+    workers = min(workers or multiprocessing.cpu_count(), len(docs))
+    if not isinstance(query, PreparedQuery):
+        query = prepare_query(query)
+
+    if workers <= 1:
+        return [highlight_doc(doc, query) for doc in docs]
+
+    # a handful of chunks per worker keeps the workers evenly loaded without
+    # paying the IPC overhead for every single doc
+    chunksize = max(1, len(docs) // (workers * 4))
+
+    pool = multiprocessing.Pool(workers, initializer=_init_highlight_worker, initargs=(query,))
+    try:
+        return pool.map(_highlight_worker_doc, docs, chunksize)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _init_highlight_worker(query):
+    """
+    Pool initializer for highlight_docs(). Stores the prepared query once per
+    worker process instead of sending it along with every doc.
+    """
+    global _WORKER_QUERY
+    _WORKER_QUERY = query
+
+
+def _highlight_worker_doc(doc):
+    """
+    Pool task for highlight_docs(). Highlights doc using the query stored
+    by _init_highlight_worker().
+    """
+    return highlight_doc(doc, _WORKER_QUERY)
+
 if __name__ == '__main__':
-    print "I LOVE FRIED chickens!!! " \
-                    "Stephanie HATES fried chicken! " \
-                    u"Love that Çhicken delicious!"
-    print highlight_doc("I LOVE FRIED chickens!!! " \
-                        "Stephanie HATES fried chicken! " \
-                        u"Love that Çhicken delicious!",
-                        'fried chicken')
+    print("I LOVE FRIED chickens!!! "
+          "Stephanie HATES fried chicken! "
+          "Love that Çhicken delicious!")
+    print(highlight_doc("I LOVE FRIED chickens!!! "
+                        "Stephanie HATES fried chicken! "
+                        "Love that Çhicken delicious!",
+                        'fried chicken'))
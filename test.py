@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
 import re
@@ -26,6 +26,8 @@ class HighlightTestCase(unittest.TestCase):
 
         assert '[[highlight]]' not in result
         assert '[[endhighlight]]' not in result
+        assert result == 'each cuppie cake is $3 a pop but the vanilla on chocolate is simply put it -dlish!...'
+        assert highlight('Gross!', 'yummy') == 'Gross!'
 
         doc = """LAWD. Best pizza ever. Oh lawd this is my happy place. Anytime I'm anywhere near San Francisco I demand a stop to this place. I was up here the week of my birthday and spent $80 on pizza. We ate two and got one to go, for the trip home. I love you, pizzeria delfina.
         Bonus points: Sitting at my table minding my bidness when a handsome dude was strolling down the street, looking very annoying, when I noticed he was carting around a full skeleton in a tote bag, on his shoulder. WTF??!?!
@@ -39,6 +41,116 @@ class HighlightTestCase(unittest.TestCase):
         assert '[[highlight]]' in result
         assert '[[endhighlight]]' in result
 
+        highlight.cache_clear()
+        result = highlight(doc, 'pizza birthday')
+        assert highlight(doc, 'pizza birthday') == result
+        assert highlight.cache_info().hits == 1
+
+
+class PrepareQueryTestCase(unittest.TestCase):
+    def test(self):
+        from highlighter import highlight_doc
+        from highlighter import prepare_query
+
+        query = prepare_query('Loves  pizzas!')
+
+        assert prepare_query(None) == ((), frozenset())
+        assert query.tokens == ('Loves', 'pizzas')
+        assert query.stems == frozenset(['love', 'pizza'])
+
+        doc = "I was up here the week of my birthday and spent $80 on pizza. I love you, pizzeria delfina."
+        assert highlight_doc(doc, query) == highlight_doc(doc, 'Loves  pizzas!')
+
+
+class HighlightDocsTestCase(unittest.TestCase):
+    def test(self):
+        from highlighter import highlight_doc
+        from highlighter import highlight_docs
+
+        docs = ["I LOVE FRIED chickens!!! Stephanie HATES fried chicken! Love that chicken delicious!",
+                "The fried chicken here is the best. Skip the fries.",
+                "Nothing to see here, just a long review about the weather and the parking.",
+                "Chicken chicken chicken, fried to perfection."]
+        expected = [highlight_doc(doc, 'fried chicken') for doc in docs]
+
+        assert highlight_docs([], 'fried chicken') == []
+        assert highlight_docs(docs, 'fried chicken', workers=1) == expected
+        assert highlight_docs(docs, 'fried chicken', workers=2) == expected
+        assert highlight_docs(iter(docs), 'fried chicken') == expected
+
+
+class BestWindowTestCase(unittest.TestCase):
+    def test(self):
+        from highlighter import best_window
+        from highlighter import get_window_scores
+
+        scorecard = [0.0, 1.0, 0.1, 0.0, 1.0, 1.0, 0.1, 0.0, 0.0]
+
+        assert best_window(scorecard, 3) == (2.1, 4, 7)
+        assert best_window(scorecard, 1) == (1.0, 1, 2)
+        assert best_window(scorecard, 20) == (3.2, 0, 9)
+        assert best_window([], 20) == (0.0, 0, 0)
+
+        scored_windows = get_window_scores(scorecard, 3)
+        assert len(scored_windows) == 6
+        assert scored_windows[0] == (1.1, 0, 3)
+        scored_windows.sort(key=lambda item: -item[0])
+        assert scored_windows[0] == best_window(scorecard, 3)
+
+
+class BestWindowForIndexTestCase(unittest.TestCase):
+    def test(self):
+        from highlighter import best_window
+        from highlighter import best_window_for_index
+        from highlighter import build_scorecard
+        from highlighter import build_stem_index
+        from highlighter import english_suffix_stemmer as stemmer
+        from highlighter import score_index
+        from highlighter import tokenize
+
+        regex = re.compile(r'(\W)')
+
+        doc = "This ham sammy is the bomb! I love ham, ham loves me."
+        tokens = tokenize(doc, regex)
+        stem_lookup = dict((token, stemmer(token)) for token in tokens)
+        stem_index = build_stem_index(tokens, stem_lookup)
+        score_fn = lambda stem: (1.0 if stem == 'ham' else 0.0) + (0.1 if stem == 'love' else 0.0)
+
+        for window_size in (1, 5, 20, len(doc), 100):
+            scorecard = build_scorecard(doc, 0.0)
+            score_index(stem_index, scorecard, score_fn)
+            assert best_window_for_index(stem_index, len(doc), score_fn, window_size) == best_window(scorecard, window_size)
+
+        assert best_window_for_index(stem_index, len(doc), score_fn, 12) == (6.3, 31, 43)
+        assert best_window_for_index({}, len(doc), score_fn, 20) == (0.0, 0, 20)
+        assert best_window_for_index({}, 0, score_fn, 20) == (0.0, 0, 0)
+
+
+class BestWindowForTokensTestCase(unittest.TestCase):
+    def test(self):
+        from highlighter import best_window_for_index
+        from highlighter import best_window_for_tokens
+        from highlighter import build_stem_index
+        from highlighter import build_token_offsets
+
+        tokens = ['I', ' ', 'love', ' ', 'ham', ',', ' ', 'ham', ' ', 'loves', ' ', 'me', '.']
+        stem_lookup = {'I': 'i', 'love': 'love', 'ham': 'ham', 'loves': 'love', 'me': 'me'}
+        stems = ['i', 'love', 'ham', 'me', '']
+        token_stem_ids = [stems.index(stem_lookup.get(token, '')) for token in tokens]
+        stem_scores = [0.0, 0.1, 1.0, 0.0, 0.0]
+        stem_lens = [len(stem) for stem in stems]
+        offsets = build_token_offsets(tokens)
+        stem_index = build_stem_index(tokens, stem_lookup)
+        score_fn = dict(zip(stems, stem_scores)).get
+
+        for window_size in (1, 4, 8, 100):
+            assert best_window_for_tokens(offsets, token_stem_ids, stem_scores, stem_lens, window_size) == \
+                best_window_for_index(stem_index, len(''.join(tokens)), score_fn, window_size)
+
+        assert best_window_for_tokens(offsets, token_stem_ids, stem_scores, stem_lens, 8) == (6.0, 7, 15)
+        assert best_window_for_tokens(offsets, token_stem_ids, [0, 1, 10, 0, 0], stem_lens, 8) == (60, 7, 15)
+        assert best_window_for_tokens([0], [], [], [], 20) == (0, 0, 0)
+
 
 class ScoreIndexTestCase(unittest.TestCase):
     def test(self):
@@ -78,6 +190,7 @@ class BuildStemIndexTestCase(unittest.TestCase):
         assert build_stem_index('', None) == {}
         assert build_stem_index(tokens, None) == {}
         assert build_stem_index(tokens, {'This': 'dis'}) == {'dis': [(0, 4)]}
+        assert build_stem_index(tokens, {'ham': 'ham'}, [0, 5, 9, 15, 18, 22, 28]) == {'ham': [(5, 9)]}
         assert build_stem_index(tokens, stem_lookup) == {'the': [(14, 17)],
                 'sammy': [(7, 12)],
                 'bomb!': [(17, 22)],
@@ -85,6 +198,51 @@ class BuildStemIndexTestCase(unittest.TestCase):
                 'thi': [(0, 4)]}
 
 
+class FindBestTerminalTokenTestCase(unittest.TestCase):
+    def test(self):
+        from highlighter import build_terminal_indices
+        from highlighter import find_best_terminal_token
+
+        sentence_terminals = set('.!')
+        tokens = ['Yum', '!', '', ' ', 'Good', ' ', 'food', '.', ' ', 'Bye']
+        terminal_indices = build_terminal_indices(tokens, sentence_terminals)
+
+        assert build_terminal_indices(None, sentence_terminals) == []
+        assert build_terminal_indices(tokens, ['.', '!']) == [1, 7]
+        assert build_terminal_indices(tokens, '.') == [7]
+        assert build_terminal_indices(tokens, None) == []
+        assert terminal_indices == [1, 7]
+        assert find_best_terminal_token(6, tokens, sentence_terminals, -1) == 2
+        assert find_best_terminal_token(6, tokens, sentence_terminals, 1) == 7
+        assert find_best_terminal_token(6, tokens, sentence_terminals, 1, terminal_indices=[]) == 9
+        assert find_best_terminal_token(6, tokens, sentence_terminals, -1, terminal_indices=[]) == 0
+        assert find_best_terminal_token(14, tokens, sentence_terminals, -1, terminal_indices=terminal_indices) == 2
+        assert find_best_terminal_token(15, tokens, sentence_terminals, 1, terminal_indices=terminal_indices) == 9
+        assert find_best_terminal_token(0, tokens, sentence_terminals, 1) == 0
+        self.assertRaises(Exception, find_best_terminal_token, 0, tokens, sentence_terminals, 0)
+
+
+class DataIndexToTokenIndexTestCase(unittest.TestCase):
+    def test(self):
+        from highlighter import data_index_to_token_index
+        from highlighter import build_token_offsets
+
+        tokens = ['She', ' ', 'loves', '!', '', '!']
+        offsets = build_token_offsets(tokens)
+
+        assert build_token_offsets(None) == [0]
+        assert offsets == [0, 3, 4, 9, 10, 10, 11]
+        assert data_index_to_token_index(0, tokens) == 0
+        assert data_index_to_token_index(3, tokens) == 0
+        assert data_index_to_token_index(4, tokens) == 1
+        assert data_index_to_token_index(5, tokens, offsets) == 2
+        assert data_index_to_token_index(10, tokens, offsets) == 3
+        assert data_index_to_token_index(11, tokens, offsets) == 5
+        assert data_index_to_token_index(12, tokens, offsets) is None
+        assert data_index_to_token_index(-1, tokens, offsets) is None
+        assert data_index_to_token_index(0, []) is None
+
+
 class BuildScorecardTestCase(unittest.TestCase):
     def test(self):
         from highlighter import build_scorecard
@@ -119,6 +277,10 @@ class TokenizeTestCase(unittest.TestCase):
         assert tokenize(u'Yelp是涼爽', regex) == [u'Yelp是涼爽']
         assert tokenize(u'Yelp 是涼爽', regex) == [u'Yelp', u'是涼爽']
 
+        from highlighter import _TOKENIZE_DOC_RE, _TOKENIZE_DOC_ASCII_RE
+        doc = "I'm   the_best!!! 4 real, (no joke)...\n\tok?"
+        assert tokenize(doc, _TOKENIZE_DOC_ASCII_RE) == tokenize(doc, _TOKENIZE_DOC_RE)
+
 
 class EnglishSuffixStemmerTestCase(unittest.TestCase):
     def test(self):